@@ -1,17 +1,11 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
 from kg_rag_engine import KGRAGEngine # From Task 1
-
-# Load your API key from the .env file
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+from llm_client import get_llm_client
 
 class NmapAgent:
     def __init__(self):
         self.brain = KGRAGEngine()
-        # We use Gemini 1.5 Flash for fast and smart classification
-        self.classifier_model = genai.GenerativeModel('gemini-2.5-flash')
+        # Same shared Gemini client as the NmapManager (timeouts, retries, circuit breaker)
+        self.llm = get_llm_client()
         
     def classify_complexity(self, intent):
         """Uses Google Gemini to decide if the task is Easy, Medium, or Hard."""
@@ -28,8 +22,7 @@ class NmapAgent:
         """
         
         try:
-            response = self.classifier_model.generate_content(prompt)
-            complexity = response.text.strip()
+            complexity = self.llm.generate(prompt)
             # Ensure the response is one of our expected categories
             if complexity in ["Easy", "Medium", "Hard"]:
                 return complexity
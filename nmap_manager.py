@@ -1,15 +1,13 @@
 
 
-import os
 from dotenv import load_dotenv
 from kg_rag_engine import KGRAGEngine # From Task 1
 from peft import PeftModel
 from transformers import T5Tokenizer, T5ForConditionalGeneration
 import torch
 
-# --- NEW SDK IMPORT ---
-from google import genai
-from google.genai import types
+# --- Shared LLM client (Gemini or local stub) ---
+from llm_client import get_llm_client, classify_locally
 
 # Load environment variables
 load_dotenv()
@@ -23,13 +21,8 @@ class NmapManager:
         # 1. Initialize the 'Brain' (KG-RAG)
         self.kg_rag = KGRAGEngine()
         
-        # 2. Initialize the 'Classifier' (NEW SDK)
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in .env")
-            
-        self.client = genai.Client(api_key=api_key)
-        self.gemini_model = "gemini-2.5-flash" 
+        # 2. Initialize the 'Classifier' (shared, rate-limited LLM client)
+        self.llm = get_llm_client()
         
         # 3. Initialize the 'Specialist' (LoRA Model)
         print("[System] Loading LoRA Specialist Model...")
@@ -49,26 +42,10 @@ class NmapManager:
 
     def classify_intent(self, intent: str) -> str:
         """
-        Uses Gemini to categorize the intent. Now uses the correct SDK client.
-        """
-        prompt = f"""
-        Analyze the following user request and classify it into one of four categories:
-        - 'Irrelevant': The request is garbage (e.g., random characters like 'hhhh'), gibberish, or NOT related to network scanning/cybersecurity.
-        - 'Easy': Basic port scans, ping scans, or simple host discovery.
-        - 'Medium': Service/version detection, OS detection, or specific timing/stealth flags.
-        - 'Hard': Vulnerability scanning, custom scripts, or complex multi-step reconnaissance.
-        
-        Intent: "{intent}"
-        
-        Respond with ONLY the category name: Irrelevant, Easy, Medium, or Hard.
+        Uses Gemini to categorize the intent. Goes through the shared LLM client (batched when LLM_BATCH_CLASSIFY=1).
         """
         try:
-            # --- FIX: Use self.client.models.generate_content ---
-            response = self.client.models.generate_content(
-                model=self.gemini_model,
-                contents=prompt
-            )
-            category = response.text.strip()
+            category = self.llm.classify(intent)
             # Clean up potential extra whitespace or punctuation
             if "Irrelevant" in category: return "Irrelevant"
             if "Easy" in category: return "Easy"
@@ -80,8 +57,8 @@ class NmapManager:
         except Exception as e:
             print(f"[Error] Gemini Classification failed: {e}")
             # --- CRITICAL CHANGE: If API fails, do NOT default to Easy for garbage inputs ---
-            # Ideally, we fail safely, but for now, we keep Easy ONLY if it looks safe.
-            return "Irrelevant"
+            # Fall back to keyword matching; anything unrecognized stays Irrelevant.
+            return classify_locally(intent)
  
     def _generate_with_lora(self, intent: str, target: str) -> str:
         """Helper method to generate a command using the LoRA model."""
@@ -133,17 +110,21 @@ class NmapManager:
                 Respond with ONLY the fixed Nmap command.
                 """
                 try:
-                    # --- NEW SDK CALL ---
-                    response = self.client.models.generate_content(
-                        model=self.gemini_model,
-                        contents=fix_prompt
-                    )
-                    current_command = response.text.strip()
+                    current_command = self.llm.generate(fix_prompt)
                 except:
                     current_command = current_command.replace("-A", "-sS -sV")
                 
         return current_command
 
+    def generate_command(self, category: str, intent: str, target: str) -> str:
+        """Routes an already classified intent to the matching specialized agent."""
+        if category == "Easy":
+            return self.process_easy(intent, target)
+        elif category == "Medium":
+            return self.process_medium(intent, target)
+        else:
+            return self.process_hard(intent, target)
+
     def functional_validation(self, command: str):
         """Task 4: Sends the command to the MCP server."""
         print(f"\n[Task 4] Starting Functional Validation via MCP...")
@@ -188,12 +169,7 @@ class NmapManager:
                 "mcp_report": "BLOCKED: The system determined this request is irrelevant to Nmap."
             }
 
-        if category == "Easy":
-            command = self.process_easy(intent, target)
-        elif category == "Medium":
-            command = self.process_medium(intent, target)
-        else:
-            command = self.process_hard(intent, target)
+        command = self.generate_command(category, intent, target)
             
         # Static Validation
         final_check = self.kg_rag.validate_command(command, is_root=True)
@@ -1,6 +1,12 @@
-
-from fastmcp import FastMCP
+from fastmcp import FastMCP, Context
+from kg_rag_engine import KGRAGEngine
+from typing import List, Dict, Any
+import asyncio
 import subprocess
+import threading
+import shlex
+import sys
+import re
 import os
 
 # Initialize the MCP Server
@@ -8,68 +14,279 @@ mcp = FastMCP("Nmap-Validator")
 
 # --- CONFIGURATION: SET YOUR NMAP PATH HERE ---
 # If 'where nmap' gave you a different path, paste it here inside the r"" quotes.
-NMAP_PATH = r"C:\Program Files (x86)\Nmap\nmap.exe" 
+NMAP_PATH = r"C:\Program Files (x86)\Nmap\nmap.exe"
 
-def run_nmap_scan(command: str) -> str:
+# Default time limit (seconds) for a single Nmap execution
+SCAN_TIMEOUT = 30
+
+# Upper bound for the timeout a client may request from the scan tool
+MAX_SCAN_TIMEOUT = float(os.getenv("MAX_SCAN_TIMEOUT", "300"))
+
+# How long to wait for a killed Nmap process to exit before giving up on it
+KILL_TIMEOUT = 5
+
+# How many Nmap processes may run at the same time from the MCP tools
+MAX_CONCURRENT_SCANS = int(os.getenv("MAX_CONCURRENT_SCANS", "4"))
+
+# With --stats-every, Nmap prints two lines per update:
+#   Stats: 0:00:02 elapsed; 0 hosts completed (1 up), 1 undergoing SYN Stealth Scan
+#   SYN Stealth Scan Timing: About 3.50% done; ETC: 12:00 (0:00:55 remaining)
+STATS_PATTERN = re.compile(r"^Stats: ")
+PROGRESS_PATTERN = re.compile(r"About (\d+(?:\.\d+)?)% done")
+
+# --- Resident components (shared by every tool call) ---
+kg_rag = KGRAGEngine()
+_manager = None
+_manager_lock = threading.Lock()
+_scan_slots = None
+
+def log(message: str):
+    # The default stdio transport owns stdout (JSON-RPC), so diagnostics go to stderr
+    print(message, file=sys.stderr)
+
+class _PrintsToStderr:
     """
-    The actual logic that runs the command. 
-    Import THIS function in your Python scripts.
+    Replacement for sys.stdout while the server runs over stdio.
+    Text written with print() (e.g. NmapManager's progress messages) goes to stderr,
+    while .buffer stays the real stdout that the stdio transport writes JSON-RPC to.
     """
-    # Security Check
-    if not command.strip().startswith("nmap"):
-        return "Error: Only Nmap commands are allowed."
-    
-    # 1. Replace the simple 'nmap' command with the Full Path
+    def __init__(self, stdout):
+        self.buffer = stdout.buffer
+
+    def write(self, text):
+        return sys.stderr.write(text)
+
+    def flush(self):
+        sys.stderr.flush()
+
+    def __getattr__(self, name):
+        return getattr(sys.stderr, name)
+
+def route_prints_to_stderr():
+    """Installed once at startup: swapping sys.stdout per call is not thread-safe."""
+    if not isinstance(sys.stdout, _PrintsToStderr):
+        sys.stdout = _PrintsToStderr(sys.stdout)
+
+def get_manager():
+    """
+    Returns the resident NmapManager, loading it on first use.
+    Created lazily because loading the Gemini client and the LoRA model is slow,
+    and the validate/scan tools don't need them.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            from nmap_manager import NmapManager
+            log("[MCP] Loading resident NmapManager...")
+            _manager = NmapManager()
+        return _manager
+
+def _get_scan_slots() -> asyncio.Semaphore:
+    # Created lazily so it binds to the event loop the server is running on
+    global _scan_slots
+    if _scan_slots is None:
+        _scan_slots = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
+    return _scan_slots
+
+def _split_command(command: str, posix: bool = os.name != "nt") -> List[str]:
+    """Splits a command into arguments, keeping Windows paths (backslashes) intact."""
+    args = shlex.split(command, posix=posix)
+    if not posix:
+        # Non-POSIX mode keeps the quotes around quoted arguments
+        args = [a[1:-1] if len(a) > 1 and a[0] == a[-1] == '"' else a for a in args]
+    return args
+
+def _is_nmap_command(command: str, posix: bool = os.name != "nt") -> bool:
+    # Security Check: accepts 'nmap', 'nmap.exe' or a full path to either
+    try:
+        args = _split_command(command, posix=posix)
+    except ValueError:
+        return False
+    if not args:
+        return False
+    program = re.split(r"[\\/]", args[0])[-1].lower()
+    return program in ("nmap", "nmap.exe")
+
+def _build_args(command: str) -> List[str]:
+    """
+    Splits the command into arguments (no shell, so ';' or '&&' can't chain other programs)
+    and replaces 'nmap' with the full path when it exists.
+    """
+    args = _split_command(command)
     # This ensures Python finds the executable even if PATH is broken.
     if os.path.exists(NMAP_PATH):
-        # Replaces just the first word "nmap" with the full path
-        final_command = command.replace("nmap", f'"{NMAP_PATH}"', 1)
+        args[0] = NMAP_PATH
     else:
         # Fallback: Try using just 'nmap' and hope it's in PATH
-        print(f"[Warning] Could not find Nmap at {NMAP_PATH}. Trying system PATH...")
-        final_command = command
+        log(f"[Warning] Could not find Nmap at {NMAP_PATH}. Trying system PATH...")
+    return args
+
+def _format_report(returncode: int, stdout: str, stderr: str) -> str:
+    """Turns the raw process result into the SUCCESS/FAILED report used by the pipeline."""
+    log(f"Return code: {returncode}")
+
+    # --- FIX: Check for Nmap specific failure messages even if return code is 0 ---
+    if returncode == 0:
+        # Check if Nmap actually found the target
+        if "Failed to resolve" in stderr or "0 hosts up" in stdout:
+             return f"FAILED (Target Error):\n{stderr}\n{stdout}"
+
+        return f"SUCCESS:\n{stdout}"
+    else:
+        return f"FAILED:\n{stderr}"
+
+def run_nmap_scan(command: str) -> str:
+    """
+    The actual logic that runs the command.
+    Import THIS function in your Python scripts.
+    """
+    if not _is_nmap_command(command):
+        return "Error: Only Nmap commands are allowed."
+
+    args = _build_args(command)
 
     try:
-        print(f"[MCP] Executing: {final_command}")
-        
+        log(f"[MCP] Executing: {args}")
+
         result = subprocess.run(
-            final_command, 
-            shell=True, 
-            capture_output=True, 
-            text=True, 
-            timeout=30,
+            args,
+            capture_output=True,
+            text=True,
+            timeout=SCAN_TIMEOUT,
             encoding='utf-8',     # Fix for Windows encoding
             errors='replace'      # prevents crashing on weird characters
         )
-        
-        
-        print(f"Return code: {result.returncode}")
-        print(f"Stdout: {result.stdout}")
-        print(f"Stderr: {result.stderr}")
-        
-       # ... (previous subprocess code) ...
-        
-        print(f"Return code: {result.returncode}")
-        
-        # --- FIX: Check for Nmap specific failure messages even if return code is 0 ---
-        if result.returncode == 0:
-            # Check if Nmap actually found the target
-            if "Failed to resolve" in result.stderr or "0 hosts up" in result.stdout:
-                 return f"FAILED (Target Error):\n{result.stderr}\n{result.stdout}"
-            
-            return f"SUCCESS:\n{result.stdout}"
-        else:
-            return f"FAILED:\n{result.stderr}"
-            
+
+        log(f"Stdout: {result.stdout}")
+        log(f"Stderr: {result.stderr}")
+
+        return _format_report(result.returncode, result.stdout, result.stderr)
+
     except FileNotFoundError:
         return f"ERROR: Nmap not found. Please verify the path: {NMAP_PATH}"
     except Exception as e:
         return f"ERROR: {str(e)}"
 
-# --- Define the Tool ---
+async def run_nmap_scan_async(command: str, ctx: Context = None, timeout: float = SCAN_TIMEOUT) -> str:
+    """
+    Non-blocking version of run_nmap_scan for the MCP tools.
+    Streams Nmap's stats lines as progress notifications and kills the process
+    if the tool call is cancelled, times out or fails.
+    """
+    if not _is_nmap_command(command):
+        return "Error: Only Nmap commands are allowed."
+
+    args = _build_args(command)
+    # Only strip the stats lines from the report if we asked for them
+    added_stats = ctx is not None and "--stats-every" not in args
+    if added_stats:
+        args += ["--stats-every", "2s"]
+
+    async with _get_scan_slots():
+        log(f"[MCP] Executing: {args}")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            return f"ERROR: Nmap not found. Please verify the path: {NMAP_PATH}"
+        except Exception as e:
+            return f"ERROR: {str(e)}"
+
+        stdout_lines = []
+        # Nmap restarts its percentage for every scan phase; MCP progress must only increase
+        reported = 0.0
+
+        async def read_stdout():
+            nonlocal reported
+            async for raw_line in process.stdout:
+                line = raw_line.decode('utf-8', errors='replace')
+                match = PROGRESS_PATTERN.search(line)
+                if match and ctx is not None and float(match.group(1)) > reported:
+                    reported = float(match.group(1))
+                    await ctx.report_progress(progress=reported, total=100.0)
+                if added_stats and (match or STATS_PATTERN.match(line)):
+                    continue
+                stdout_lines.append(line)
+
+        stderr_task = asyncio.create_task(process.stderr.read())
+        try:
+            try:
+                await asyncio.wait_for(read_stdout(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return f"ERROR: Command '{command}' timed out after {timeout} seconds"
+            returncode = await process.wait()
+            stderr = (await stderr_task).decode('utf-8', errors='replace')
+        except asyncio.CancelledError:
+            log(f"[MCP] Cancelled: {args}")
+            raise
+        finally:
+            # Timeout, cancellation or any other error: don't leave Nmap running
+            await _kill(process, stderr_task)
+
+        if ctx is not None:
+            await ctx.report_progress(progress=100.0, total=100.0)
+        return _format_report(returncode, "".join(stdout_lines), stderr)
+
+async def _kill(process, stderr_task):
+    if not stderr_task.done():
+        stderr_task.cancel()
+    if process.returncode is None:
+        process.kill()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=KILL_TIMEOUT)
+        except asyncio.TimeoutError:
+            log(f"[Warning] Nmap process {process.pid} did not exit after kill.")
+
+# --- Define the Tools ---
+@mcp.tool()
+async def execute_nmap_validation(command: str) -> str:
+    """Runs an Nmap command and returns the SUCCESS/FAILED report."""
+    return await run_nmap_scan_async(command)
+
 @mcp.tool()
-def execute_nmap_validation(command: str) -> str:
-    return run_nmap_scan(command)
+async def generate(intent: str, target: str, ctx: Context) -> Dict[str, Any]:
+    """Classifies the intent and generates an Nmap command, without executing it."""
+    await ctx.report_progress(progress=0, total=2)
+    # The manager is blocking (Gemini + LoRA), so keep it off the event loop
+    manager = await asyncio.to_thread(get_manager)
+    category = await asyncio.to_thread(manager.classify_intent, intent)
+    await ctx.report_progress(progress=1, total=2)
+
+    if category == "Irrelevant":
+        return {"intent": intent, "category": category, "command": None}
+
+    command = await asyncio.to_thread(manager.generate_command, category, intent, target)
+    await ctx.report_progress(progress=2, total=2)
+    return {"intent": intent, "category": category, "command": command}
+
+@mcp.tool()
+def validate(command: str, is_root: bool = True) -> Dict[str, Any]:
+    """Statically validates an Nmap command against the Knowledge Graph rules."""
+    return kg_rag.validate_command(command, is_root=is_root)
+
+@mcp.tool()
+async def validate_batch(commands: List[str], ctx: Context, is_root: bool = True) -> List[Dict[str, Any]]:
+    """Statically validates several Nmap commands in one call."""
+    results = []
+    for i, command in enumerate(commands):
+        results.append(kg_rag.validate_command(command, is_root=is_root))
+        await ctx.report_progress(progress=i + 1, total=len(commands))
+    return results
+
+@mcp.tool()
+async def scan(command: str, ctx: Context, timeout: float = SCAN_TIMEOUT) -> str:
+    """
+    Executes an Nmap command, reporting progress as Nmap runs.
+    Cancelling the tool call terminates the scan. The timeout is capped at MAX_SCAN_TIMEOUT.
+    """
+    if timeout <= 0:
+        return "Error: timeout must be greater than 0 seconds."
+    timeout = min(timeout, MAX_SCAN_TIMEOUT)
+    return await run_nmap_scan_async(command, ctx=ctx, timeout=timeout)
 
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    route_prints_to_stderr()
+    mcp.run()
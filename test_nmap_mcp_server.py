@@ -0,0 +1,219 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+from fastmcp import Client
+
+import nmap_mcp_server
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="the fake nmap is a POSIX script")
+
+FAKE_NMAP = f"""#!{sys.executable}
+import os, sys, time
+if os.getenv("FAKE_NMAP_PIDFILE"):
+    with open(os.environ["FAKE_NMAP_PIDFILE"], "w") as f:
+        f.write(str(os.getpid()))
+print("Starting Nmap " + " ".join(sys.argv[1:]), flush=True)
+if "--stats-every" in sys.argv:
+    # Real --stats-every output: two lines per update, percentage restarting for each phase
+    print("Stats: 0:00:01 elapsed; 0 hosts completed (1 up), 1 undergoing Ping Scan", flush=True)
+    print("Ping Scan Timing: About 50.00% done; ETC: 12:00 (0:00:01 remaining)", flush=True)
+    print("Stats: 0:00:02 elapsed; 0 hosts completed (1 up), 1 undergoing SYN Stealth Scan", flush=True)
+    print("SYN Stealth Scan Timing: About 20.00% done; ETC: 12:01 (0:00:08 remaining)", flush=True)
+time.sleep(float(os.getenv("FAKE_NMAP_SLEEP", "0")))
+print("Nmap done: 1 IP address (1 host up) scanned", flush=True)
+"""
+
+
+class FakeManager:
+    def __init__(self, category):
+        self.category = category
+
+    def classify_intent(self, intent):
+        print("[Manager] chatty output that must not reach stdout")
+        time.sleep(0.1)
+        print("[Manager] more chatty output")
+        return self.category
+
+    def generate_command(self, category, intent, target):
+        return f"nmap -sV {target}"
+
+
+@pytest.fixture(autouse=True)
+def fake_nmap(tmp_path, monkeypatch):
+    script = tmp_path / "nmap"
+    script.write_text(FAKE_NMAP)
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(nmap_mcp_server, "NMAP_PATH", str(tmp_path / "missing-nmap"))
+    # The scan semaphore binds to the event loop of each test
+    monkeypatch.setattr(nmap_mcp_server, "_scan_slots", None)
+    return tmp_path
+
+
+def unwrap(result):
+    # Non-object return values are wrapped as {"result": ...}
+    return result.structured_content.get("result", result.structured_content)
+
+
+async def call_tool(name, arguments, **client_options):
+    async with Client(nmap_mcp_server.mcp, **client_options) as client:
+        return unwrap(await client.call_tool(name, arguments))
+
+
+def test_validate_batch_keeps_order():
+    commands = ["nmap -sV 10.0.0.1", "nmap -sS -sT 10.0.0.2", "nmap -F 10.0.0.3"]
+    results = asyncio.run(call_tool("validate_batch", {"commands": commands}))
+
+    assert [r["command"] for r in results] == commands
+    assert [r["is_valid"] for r in results] == [True, False, True]
+
+
+def test_generate_returns_no_command_for_irrelevant(monkeypatch):
+    monkeypatch.setattr(nmap_mcp_server, "_manager", FakeManager("Irrelevant"))
+    result = asyncio.run(call_tool("generate", {"intent": "hhhh", "target": "hhhh"}))
+
+    assert result["category"] == "Irrelevant"
+    assert result["command"] is None
+
+
+def test_concurrent_generate_keeps_stdout_clean(monkeypatch, capfd):
+    monkeypatch.setattr(nmap_mcp_server, "_manager", FakeManager("Medium"))
+    # What `python nmap_mcp_server.py` installs before serving over stdio
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+    nmap_mcp_server.route_prints_to_stderr()
+
+    async def generate_concurrently():
+        async with Client(nmap_mcp_server.mcp) as client:
+            calls = [client.call_tool("generate", {"intent": f"scan {i}", "target": "10.0.0.1"}) for i in range(6)]
+            return [unwrap(r) for r in await asyncio.gather(*calls)]
+
+    results = asyncio.run(generate_concurrently())
+    sys.stdout.buffer.write(b"transport output\n")
+    sys.stdout.buffer.flush()
+
+    assert all(r["command"] == "nmap -sV 10.0.0.1" for r in results)
+    captured = capfd.readouterr()
+    assert captured.out == "transport output\n"
+    assert captured.err.count("more chatty output") == 6
+
+
+def test_generate_routes_relevant_intent(monkeypatch):
+    monkeypatch.setattr(nmap_mcp_server, "_manager", FakeManager("Medium"))
+    result = asyncio.run(call_tool("generate", {"intent": "find versions", "target": "10.0.0.1"}))
+
+    assert result == {"intent": "find versions", "category": "Medium", "command": "nmap -sV 10.0.0.1"}
+
+
+def test_scan_report_matches_execute_nmap_validation():
+    scanned = asyncio.run(call_tool("scan", {"command": "nmap -sS 127.0.0.1"}))
+    executed = asyncio.run(call_tool("execute_nmap_validation", {"command": "nmap -sS 127.0.0.1"}))
+
+    assert scanned.startswith("SUCCESS:")
+    assert "% done" not in scanned
+    assert "Stats:" not in scanned
+    assert scanned == executed.replace("Starting Nmap -sS 127.0.0.1", "Starting Nmap -sS 127.0.0.1 --stats-every 2s")
+
+
+def test_scan_rejects_chained_commands():
+    result = asyncio.run(call_tool("scan", {"command": "echo nmap; rm -rf /tmp/x"}))
+    assert result == "Error: Only Nmap commands are allowed."
+
+    # Shell operators are passed to nmap as plain arguments, not run
+    result = asyncio.run(call_tool("scan", {"command": "nmap 127.0.0.1; echo injected"}))
+    assert "Starting Nmap 127.0.0.1; echo injected" in result
+
+
+def test_scan_progress_never_decreases():
+    progress = []
+
+    async def on_progress(value, total, message):
+        progress.append(value)
+
+    asyncio.run(call_tool("scan", {"command": "nmap 127.0.0.1"}, progress_handler=on_progress))
+    assert progress == [50.0, 100.0]
+
+
+@pytest.mark.parametrize("command, args", [
+    (r"nmap -sV -oN C:\scans\out.txt 10.0.0.1", ["nmap", "-sV", "-oN", r"C:\scans\out.txt", "10.0.0.1"]),
+    (r'"C:\Program Files (x86)\Nmap\nmap.exe" -F 10.0.0.1', [r"C:\Program Files (x86)\Nmap\nmap.exe", "-F", "10.0.0.1"]),
+])
+def test_windows_commands_keep_backslashes(command, args):
+    assert nmap_mcp_server._split_command(command, posix=False) == args
+    assert nmap_mcp_server._is_nmap_command(command, posix=False)
+
+
+def test_scan_rejects_invalid_timeout():
+    result = asyncio.run(call_tool("scan", {"command": "nmap 127.0.0.1", "timeout": 0}))
+    assert result == "Error: timeout must be greater than 0 seconds."
+
+
+def test_scan_timeout_is_capped(monkeypatch):
+    monkeypatch.setattr(nmap_mcp_server, "MAX_SCAN_TIMEOUT", 0.5)
+    monkeypatch.setenv("FAKE_NMAP_SLEEP", "30")
+    result = asyncio.run(call_tool("scan", {"command": "nmap 127.0.0.1", "timeout": 1e9}))
+
+    assert result == "ERROR: Command 'nmap 127.0.0.1' timed out after 0.5 seconds"
+
+
+def test_scan_timeout_returns_error_report(monkeypatch):
+    monkeypatch.setenv("FAKE_NMAP_SLEEP", "30")
+    start = time.monotonic()
+    result = asyncio.run(call_tool("scan", {"command": "nmap 127.0.0.1", "timeout": 0.5}))
+
+    assert result == "ERROR: Command 'nmap 127.0.0.1' timed out after 0.5 seconds"
+    assert time.monotonic() - start < 5
+
+
+def test_cancel_terminates_nmap(fake_nmap, monkeypatch):
+    pidfile = fake_nmap / "nmap.pid"
+    monkeypatch.setenv("FAKE_NMAP_SLEEP", "30")
+    monkeypatch.setenv("FAKE_NMAP_PIDFILE", str(pidfile))
+
+    async def cancel_scan():
+        task = asyncio.create_task(nmap_mcp_server.run_nmap_scan_async("nmap 127.0.0.1"))
+        while not pidfile.exists() or not pidfile.read_text():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(task, timeout=5)
+        return int(pidfile.read_text())
+
+    pid = asyncio.run(cancel_scan())
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+
+def test_progress_error_terminates_nmap(fake_nmap, monkeypatch):
+    pidfile = fake_nmap / "nmap.pid"
+    monkeypatch.setenv("FAKE_NMAP_SLEEP", "30")
+    monkeypatch.setenv("FAKE_NMAP_PIDFILE", str(pidfile))
+
+    class DisconnectedContext:
+        async def report_progress(self, progress, total):
+            raise RuntimeError("client disconnected")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(asyncio.wait_for(
+            nmap_mcp_server.run_nmap_scan_async("nmap 127.0.0.1", ctx=DisconnectedContext()), timeout=5))
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pidfile.read_text()), 0)
+
+
+def test_cancelled_scans_release_their_slots(monkeypatch):
+    monkeypatch.setattr(nmap_mcp_server, "MAX_CONCURRENT_SCANS", 1)
+    monkeypatch.setenv("FAKE_NMAP_SLEEP", "30")
+
+    async def cancel_then_scan():
+        for _ in range(2):
+            task = asyncio.create_task(nmap_mcp_server.run_nmap_scan_async("nmap 127.0.0.1"))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(task, timeout=5)
+        monkeypatch.setenv("FAKE_NMAP_SLEEP", "0")
+        return await asyncio.wait_for(nmap_mcp_server.run_nmap_scan_async("nmap 127.0.0.1"), timeout=5)
+
+    assert asyncio.run(cancel_then_scan()).startswith("SUCCESS:")